@@ -29,8 +29,7 @@ def download_prepare(data: List[Episode]) -> None:
     driver = get_download_driver(cfg.download_delegate)
     for download in queue:
         save_path = bangumi_save_path(download.name).joinpath(str(download.episode))
-        if not save_path.exists():
-            os.makedirs(save_path)
+        os.makedirs(save_path, exist_ok=True)
 
         # mark as downloading
         download.status = STATUS_DOWNLOADING
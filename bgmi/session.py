@@ -7,10 +7,17 @@ from requests.adapters import HTTPAdapter, Retry
 
 from bgmi.config import cfg
 
+# large enough for every worker of bgmi.utils.download_cover to keep its own connection to a host
+POOL_MAXSIZE = 16
+
 session = requests.Session()
 
+adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAXSIZE, max_retries=Retry(total=2, backoff_factor=0.3))
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
 retries = Retry(total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
-session.mount("https://mikanani.me/", HTTPAdapter(max_retries=retries))
+session.mount("https://mikanani.me/", HTTPAdapter(pool_maxsize=POOL_MAXSIZE, max_retries=retries))
 
 cookies_file = pathlib.Path(cfg.tmp_path).joinpath("mikan_cookies.txt")
 
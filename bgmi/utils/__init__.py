@@ -1,28 +1,28 @@
+import contextlib
 import functools
-import glob
-import gzip
+import hashlib
 import json
 import logging
 import os
 import re
-import struct
-import subprocess
+import signal
 import sys
-import tarfile
 import time
 import traceback
-from io import BytesIO
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from shutil import move, rmtree
-from typing import Any, Callable, List, Optional, Tuple, TypeVar
+from shutil import rmtree
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
 import requests
+import urllib3
 from anime_episode_parser import parse_episode as _parse_episode
 
 from bgmi import __admin_version__, __version__
 from bgmi.config import BGMI_PATH, IS_WINDOWS, cfg
 from bgmi.lib.constants import SUPPORT_WEBSITE
+from bgmi.session import POOL_MAXSIZE
+from bgmi.session import session as _SESSION
 from bgmi.website.model import Episode
 
 F = TypeVar("F", bound=Callable[..., Any])
@@ -48,6 +48,9 @@ except OSError:
 def log_utils_function(func: F) -> F:
     @functools.wraps(func)
     def echo_func(*func_args, **func_kwargs):  # type: ignore
+        if not logger.isEnabledFor(logging.DEBUG):
+            return func(*func_args, **func_kwargs)
+
         logger.debug("")
         logger.debug("start function %s %r %r", func.__name__, func_args, func_kwargs)
         r = func(*func_args, **func_kwargs)
@@ -58,18 +61,32 @@ def log_utils_function(func: F) -> F:
     return echo_func  # type: ignore
 
 
-if (
-    IS_WINDOWS and "bash" not in os.getenv("SHELL", "").lower() and "zsh" not in os.getenv("SHELL", "").lower()
-):  # pragma: no cover
-    GREEN = ""
-    YELLOW = ""
-    RED = ""
-    COLOR_END = ""
-else:
+def _support_ansi_color() -> bool:
+    if not IS_WINDOWS:
+        return True
+
+    try:  # pragma: no cover
+        # pylint: disable=import-outside-toplevel
+        import colorama
+
+        # enable ansi escape codes on cmd.exe and powershell, added in colorama 0.4.6
+        colorama.just_fix_windows_console()
+        return True
+    except (ImportError, AttributeError):  # pragma: no cover
+        shell = os.getenv("SHELL", "").lower()
+        return "bash" in shell or "zsh" in shell
+
+
+if _support_ansi_color():
     GREEN = "\033[1;32m"
     YELLOW = "\033[1;33m"
     RED = "\033[1;31m"
     COLOR_END = "\033[0m"
+else:  # pragma: no cover
+    GREEN = ""
+    YELLOW = ""
+    RED = ""
+    COLOR_END = ""
 
 color_map = {
     "print_info": "",
@@ -85,16 +102,18 @@ indicator_map = {
     "print_error": "[x] ",
 }
 
-FRONTEND_NPM_URL = "https://registry.npmjs.com/bgmi-frontend/"
 PACKAGE_JSON_URL = f"https://registry.npmjs.com/bgmi-frontend/{__admin_version__}"
 
+_COVER_DOWNLOAD_WORKERS = POOL_MAXSIZE
+
 
 def _indicator(f):  # type: ignore
+    prefix = indicator_map.get(f.__qualname__, "")
+
     @functools.wraps(f)
     def wrapper(*args, **kwargs):  # type: ignore
         if kwargs.get("indicator", True):
-            func_name = f.__qualname__
-            args = (indicator_map.get(func_name, "") + args[0],)
+            args = (prefix + args[0], *args[1:])
         f(*args, **kwargs)
         sys.stdout.flush()
 
@@ -102,15 +121,12 @@ def _indicator(f):  # type: ignore
 
 
 def colorize(f):  # type: ignore
+    b = color_map.get(f.__qualname__, "")
+    e = COLOR_END if b else ""
+
     @functools.wraps(f)
-    def wrapper(*args, **kwargs):  # type: ignore
-        func_name = f.__qualname__
-        b, e = (
-            color_map.get(func_name, ""),
-            COLOR_END if color_map.get(func_name) else "",
-        )
-        args = tuple(b + s + e for s in args)
-        return f(*args, **kwargs)
+    def wrapper(message, *args, **kwargs):  # type: ignore
+        return f(b + message + e, *args, **kwargs)
 
     return wrapper
 
@@ -160,7 +176,7 @@ def test_connection() -> bool:
     try:
         for website in SUPPORT_WEBSITE:
             if cfg.data_source == website["id"]:
-                requests.request("head", website["url"], timeout=10)
+                _SESSION.head(website["url"], timeout=10)
     except requests.RequestException:
         return False
     return True
@@ -176,56 +192,127 @@ def bug_report() -> None:  # pragma: no cover
 _DEFAULT_TERMINAL_WIDTH = 80
 
 
+@functools.lru_cache(maxsize=1)
 @log_utils_function
 def get_terminal_col() -> int:  # pragma: no cover
-    # pylint: disable=import-outside-toplevel,import-error
-    # https://gist.github.com/jtriley/1108174
-    if not IS_WINDOWS:
-        import fcntl
-        import termios
+    try:
+        return os.get_terminal_size(0).columns
+    except OSError:
+        return _DEFAULT_TERMINAL_WIDTH
 
-        try:
-            col = struct.unpack(
-                "HHHH",
-                fcntl.ioctl(0, termios.TIOCGWINSZ, struct.pack("HHHH", 0, 0, 0, 0)),
-            )[
-                1
-            ]  # type: int
-
-            return col
-        except Exception:
-            return _DEFAULT_TERMINAL_WIDTH
+
+if not IS_WINDOWS:  # pragma: no cover
+    # terminal size is cached, drop it when the terminal is resized
+    try:
+        signal.signal(signal.SIGWINCH, lambda *_: get_terminal_col.cache_clear())
+    except ValueError:
+        # not in main thread
+        pass
+
+
+_VERSION_RE = re.compile(r"(\d+(?:\.\d+)*)(?:[-_.]?([a-z]+)[-_.]?(\d*))?", re.IGNORECASE)
+_FINAL_RELEASE_RANK = 4
+_VERSION_TAG_RANK = {
+    "dev": 0,
+    "a": 1,
+    "alpha": 1,
+    "b": 2,
+    "beta": 2,
+    "c": 3,
+    "rc": 3,
+    "pre": 3,
+    "preview": 3,
+    "post": 5,
+    "rev": 5,
+    "r": 5,
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_version(version: str) -> Tuple[Tuple[int, ...], Tuple[int, int]]:
+    """
+    parse a version string to a comparable tuple, so "10.0.0" is newer than "9.0.0",
+    and "4.0.0.dev1" < "4.0.0a1" < "4.0.0b1" < "4.0.0rc1" < "4.0.0" < "4.0.0.post1"
+    """
+    m = _VERSION_RE.fullmatch(version.strip())
+    if not m:
+        raise ValueError(f"invalid version {version!r}")
+
+    release = [int(x) for x in m.group(1).split(".")]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+
+    tag = m.group(2)
+    if not tag:
+        return tuple(release), (_FINAL_RELEASE_RANK, 0)
+
+    rank = _VERSION_TAG_RANK.get(tag.lower())
+    if rank is None:
+        raise ValueError(f"unknown version tag {tag!r} in {version!r}")
+    return tuple(release), (rank, int(m.group(3) or 0))
+
+
+_HTTP_CACHE_PATH = BGMI_PATH.joinpath("http_cache.json")
+# cached responses are dropped whenever bgmi or the frontend version changes
+_HTTP_CACHE_CTX = hashlib.sha256(f"{__version__}:{__admin_version__}".encode()).hexdigest()
+_VERSION_CHECK_TTL = 24 * 3600
+
+
+def _load_http_cache() -> Dict[str, Any]:
+    try:
+        with open(_HTTP_CACHE_PATH, encoding="utf8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(cache, dict) or cache.get("ctx") != _HTTP_CACHE_CTX:
+        return {}
+
+    entries = cache.get("entries")
+    return entries if isinstance(entries, dict) else {}
+
+
+def _save_http_cache(entries: Dict[str, Any]) -> None:
+    try:
+        with open(_HTTP_CACHE_PATH, "w", encoding="utf8") as f:
+            json.dump({"ctx": _HTTP_CACHE_CTX, "entries": entries}, f)
+    except OSError:
+        logger.warning("failed to write http cache %s", _HTTP_CACHE_PATH)
+
+
+def _cached_get_json(url: str, ttl_seconds: int) -> Any:
+    """
+    GET a json document, reusing the response stored on disk if it is younger than ``ttl_seconds``.
+    stale responses are revalidated with ``If-None-Match`` when upstream sent an ``ETag``
+
+    :param url: url of the json document
+    :param ttl_seconds: how long a cached response is considered fresh
+    :return: decoded json body
+    """
+    key = hashlib.sha256(url.encode()).hexdigest()
+    entries = _load_http_cache()
+    entry = entries.get(key)
+    now = time.time()
+
+    headers = {}
+    if entry:
+        if now - entry["ts"] < ttl_seconds:
+            return entry["body"]
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+
+    r = _SESSION.get(url, timeout=60, headers=headers)
+    if entry and r.status_code == 304:
+        entry["ts"] = now
     else:
-        try:
-            from ctypes import create_string_buffer, windll  # type: ignore[attr-defined]
-
-            # stdin handle is -10
-            # stdout handle is -11
-            # stderr handle is -12
-            h = windll.kernel32.GetStdHandle(-12)
-            csbi = create_string_buffer(22)
-            res = windll.kernel32.GetConsoleScreenBufferInfo(h, csbi)
-            if res:
-                (
-                    bufx,
-                    bufy,
-                    curx,
-                    cury,
-                    wattr,
-                    left,
-                    top,
-                    right,
-                    bottom,
-                    maxx,
-                    maxy,
-                ) = struct.unpack("hhhhHhhhhhh", csbi.raw)
-                sizex = right - left + 1  # type: int
-                return sizex
-            else:
-                cols = int(subprocess.check_output("tput cols"))
-                return cols
-        except Exception:
-            return _DEFAULT_TERMINAL_WIDTH
+        body = r.json()
+        if r.status_code != 200:
+            return body
+        entry = {"ts": now, "etag": r.headers.get("etag"), "body": body}
+
+    entries[key] = entry
+    _save_http_cache(entries)
+    return entry["body"]
 
 
 @log_utils_function
@@ -233,13 +320,13 @@ def check_update(mark: bool = True) -> None:
     def update() -> None:
         try:
             print_info("Checking update ...")
-            pypi = requests.get("https://pypi.org/pypi/bgmi/json", timeout=60).json()
+            pypi = _cached_get_json("https://pypi.org/pypi/bgmi/json", _VERSION_CHECK_TTL)
             version = pypi["info"]["version"]
 
             with open(os.path.join(BGMI_PATH, "latest"), "w", encoding="utf8") as f:
                 f.write(version)
 
-            if version > __version__:
+            if _parse_version(version) > _parse_version(__version__):
                 print_warning(
                     "Please update bgmi to the latest version {}{}{}."
                     "\nThen execute `bgmi upgrade` to migrate database".format(GREEN, version, COLOR_END)
@@ -247,12 +334,12 @@ def check_update(mark: bool = True) -> None:
             else:
                 print_success("Your BGmi is the latest version.")
 
-            package_json = requests.get(PACKAGE_JSON_URL, timeout=60).json()
+            package_json = _cached_get_json(PACKAGE_JSON_URL, _VERSION_CHECK_TTL)
             admin_version = package_json["version"]
-            if glob.glob(os.path.join(cfg.front_static_path, "package.json")):
+            if os.path.isfile(os.path.join(cfg.front_static_path, "package.json")):
                 with open(os.path.join(cfg.front_static_path, "package.json"), encoding="utf8") as f:
                     local_version = json.loads(f.read())["version"]
-                if [int(x) for x in admin_version.split(".")] > [int(x) for x in local_version.split(".")]:
+                if _parse_version(admin_version) > _parse_version(local_version):
                     get_web_admin(method="update")
             else:
                 print_info("Use 'bgmi install' to install BGmi frontend / download delegate")
@@ -279,6 +366,7 @@ def check_update(mark: bool = True) -> None:
             pass
 
 
+@functools.lru_cache(maxsize=4096)
 def parse_episode(episode_title: str) -> int:
     s, c = _parse_episode(episode_title)
     if c != 1:
@@ -287,6 +375,10 @@ def parse_episode(episode_title: str) -> int:
     return s or 0
 
 
+_ILLEGAL_PATH_CHARS = str.maketrans("", "", ":*?\"<>|'")
+_URL_SCHEME_RE = re.compile(r"(https?)://")
+
+
 def normalize_path(url: str) -> str:
     """
     normalize link to path
@@ -296,10 +388,7 @@ def normalize_path(url: str) -> str:
     :return: normalized path
     :rtype: str
     """
-    url = url.replace("http://", "http/").replace("https://", "https/")
-    illegal_char = [":", "*", "?", '"', "<", ">", "|", "'"]
-    for char in illegal_char:
-        url = url.replace(char, "")
+    url = _URL_SCHEME_RE.sub(r"\1/", url).translate(_ILLEGAL_PATH_CHARS)
 
     if url.startswith("/"):
         return url[1:]
@@ -321,43 +410,70 @@ def bangumi_save_path(bangumi_name: str) -> Path:
 
 
 def get_web_admin(method: str) -> None:
+    # only needed when installing frontend, keep it out of cli startup
+    # pylint: disable=import-outside-toplevel
+    import tarfile
+    import tempfile
+
     print_info(f"{method[0].upper() + method[1:]}ing BGmi frontend")
 
     try:
-        r = requests.get(FRONTEND_NPM_URL, timeout=60).json()
-        version = requests.get(PACKAGE_JSON_URL, timeout=60).json()
+        version = _cached_get_json(PACKAGE_JSON_URL, 0)
         if "error" in version:  # pragma: no cover
             print(json.dumps(version, indent=2, ensure_ascii=False))
             print_error("unexpected npm error")
             return
-        tar_url = r["versions"][version["version"]]["dist"]["tarball"]
-        r = requests.get(tar_url, timeout=60)
+        tar_url = version["dist"]["tarball"]
     except requests.exceptions.ConnectionError:
         print_warning("failed to download web admin")
         return
     except json.JSONDecodeError:
         print_warning("failed to download web admin")
         return
-    admin_zip = BytesIO(r.content)
-    with gzip.GzipFile(fileobj=admin_zip) as f:
-        tar_file = BytesIO(f.read())
-
-    rmtree(cfg.front_static_path)
-    os.makedirs(cfg.front_static_path)
-
-    with tarfile.open(fileobj=tar_file) as tar_file_obj:
-        tar_file_obj.extractall(path=cfg.front_static_path)
-
-    for file in os.listdir(os.path.join(cfg.front_static_path, "package", "dist")):
-        move(
-            os.path.join(cfg.front_static_path, "package", "dist", file),
-            os.path.join(cfg.front_static_path, file),
-        )
-    with open(os.path.join(cfg.front_static_path, "package.json"), "w+", encoding="utf8") as pkg:
-        pkg.write(json.dumps(version))
+
+    # extract next to the current frontend and only swap it in after extraction succeeds,
+    # so a broken download can't destroy a working install
+    tmp_path = tempfile.mkdtemp(prefix=".front_static-", dir=cfg.front_static_path.parent)
+    try:
+        with _SESSION.get(tar_url, timeout=60, stream=True) as resp:
+            resp.raise_for_status()
+            # extract while downloading, without buffering the whole tarball in memory
+            resp.raw.decode_content = True
+            with tarfile.open(fileobj=resp.raw, mode="r|gz") as tar_file_obj:
+                if hasattr(tarfile, "data_filter"):
+                    tar_file_obj.extractall(path=tmp_path, filter="data")  # type: ignore[call-arg]
+                else:  # pragma: no cover
+                    tar_file_obj.extractall(path=tmp_path)
+
+        dist_path = os.path.join(tmp_path, "package", "dist")
+        with open(os.path.join(dist_path, "package.json"), "w+", encoding="utf8") as pkg:
+            pkg.write(json.dumps(version))
+
+        # move the old frontend aside instead of deleting it, so it can be restored if the swap fails
+        old_path = os.path.join(tmp_path, "old")
+        has_old = os.path.exists(cfg.front_static_path)
+        if has_old:
+            os.replace(cfg.front_static_path, old_path)
+        try:
+            os.replace(dist_path, cfg.front_static_path)
+        except OSError:
+            if has_old:
+                os.replace(old_path, cfg.front_static_path)
+            raise
+    except (tarfile.TarError, requests.RequestException, urllib3.exceptions.HTTPError, OSError):
+        print_warning("failed to download web admin")
+        return
+    finally:
+        rmtree(tmp_path, ignore_errors=True)
+
     print_success("Web admin page {} successfully. version: {}".format(method, version["version"]))
 
 
+@functools.lru_cache(maxsize=1)
+def _cover_root(save_path: Path) -> str:
+    return os.path.join(save_path, "cover")
+
+
 @log_utils_function
 def convert_cover_url_to_path(cover_url: str) -> Tuple[str, str]:
     """
@@ -369,9 +485,7 @@ def convert_cover_url_to_path(cover_url: str) -> Tuple[str, str]:
     :return: dir_path, file_path
     """
 
-    cover_url = normalize_path(cover_url)
-    file_path = os.path.join(cfg.save_path, "cover")
-    file_path = os.path.join(file_path, cover_url)
+    file_path = os.path.join(_cover_root(cfg.save_path), normalize_path(cover_url))
     dir_path = os.path.dirname(file_path)
 
     return dir_path, file_path
@@ -381,23 +495,49 @@ def convert_cover_url_to_path(cover_url: str) -> Tuple[str, str]:
 def download_file(url: str) -> Optional[requests.Response]:
     if url.startswith("https://") or url.startswith("http://"):
         print_info(f"Download: {url}")
-        return requests.get(url, timeout=60)
+        return _SESSION.get(url, timeout=60, stream=True)
     return None
 
 
+def _download_cover_file(cover_url: str) -> None:
+    import tempfile  # pylint: disable=import-outside-toplevel
+
+    r = download_file(cover_url)
+    if r is None:
+        return
+
+    with r:
+        if not r.ok:
+            return
+
+        dir_path, file_path = convert_cover_url_to_path(cover_url)
+        # workers may create the same directory concurrently
+        os.makedirs(dir_path, exist_ok=True)
+        # write to a temporary file first, a truncated cover would never be downloaded again
+        fd, part_path = tempfile.mkstemp(dir=dir_path, suffix=".part")
+        try:
+            with open(fd, "wb") as f:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+            os.replace(part_path, file_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(part_path)
+            raise
+
+
 def download_cover(cover_url_list: List[str]) -> None:
-    p = ThreadPool(4)
-    content_list = p.map(download_file, cover_url_list)
-    p.close()
-    for index, r in enumerate(content_list):
-        if not r:
-            continue
+    cover_url_list = list(dict.fromkeys(cover_url_list))
+    if not cover_url_list:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(_COVER_DOWNLOAD_WORKERS, len(cover_url_list))) as executor:
+        list(executor.map(_download_cover_file, cover_url_list))
+
 
-        dir_path, file_path = convert_cover_url_to_path(cover_url_list[index])
-        if not glob.glob(dir_path):
-            os.makedirs(dir_path)
-        with open(file_path, "wb") as f:
-            f.write(r.content)
+@functools.lru_cache(maxsize=64)
+def _compile_regex(regex: str) -> "re.Pattern[str]":
+    return re.compile(regex)
 
 
 def episode_filter_regex(data: List[Episode], regex: Optional[str] = None) -> List[Episode]:
@@ -406,18 +546,23 @@ def episode_filter_regex(data: List[Episode], regex: Optional[str] = None) -> Li
     :param data: list of bangumi dict
     :param regex: regex
     """
+    match: "Optional[re.Pattern[str]]" = None
     if regex:
         try:
-            match = re.compile(regex)
-            data = [s for s in data if match.findall(s.title)]
+            match = _compile_regex(regex)
         except re.error as e:
             if os.getenv("DEBUG"):  # pragma: no cover
                 traceback.print_exc()
                 raise e
             print_warning(f"can't compile regex {regex}, skipping filter by regex")
 
+    exclude_keywords: List[str] = []
     if cfg.enable_global_filters:
         exclude_keywords = [t.strip().lower() for t in cfg.global_filters]
-        data = [x for x in data if not x.contains_any_words(exclude_keywords)]
 
-    return data
+    return [
+        s
+        for s in data
+        if (match is None or match.search(s.title))
+        and not (exclude_keywords and s.contains_any_words(exclude_keywords))
+    ]
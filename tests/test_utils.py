@@ -1,12 +1,26 @@
+import io
+import os
 import shutil
+import tarfile
 from pathlib import Path
 from typing import List, Tuple
+from unittest import mock
 
 import pytest
+import requests
 
 from bgmi.config import cfg
 from bgmi.front.index import get_player
-from bgmi.utils import episode_filter_regex, parse_episode
+from bgmi.utils import (
+    _cached_get_json,
+    _parse_version,
+    convert_cover_url_to_path,
+    download_cover,
+    episode_filter_regex,
+    get_web_admin,
+    normalize_path,
+    parse_episode,
+)
 from bgmi.website.model import Episode
 
 _episode_cases: List[Tuple[str, int]] = [
@@ -45,6 +59,35 @@ def test_episode_parse(title, episode):
     ), f"\ntitle: {title!r}\nepisode: {episode}\nparsed episode: {parse_episode(title)}"
 
 
+@pytest.mark.parametrize(
+    ("url", "path"),
+    [
+        ("https://bangumi.moe/a/b.jpg", "https/bangumi.moe/a/b.jpg"),
+        ("http://mikanani.me/x:y?z.jpg", "http/mikanani.me/xyz.jpg"),
+        ("/a*b\"c<d>e|f'g", "abcdefg"),
+    ],
+)
+def test_normalize_path(url, path):
+    assert normalize_path(url) == path
+
+
+def test_parse_version():
+    assert _parse_version("10.0.0") > _parse_version("9.1.2")
+    assert _parse_version("4.0.1") > _parse_version("4.0.0b1")
+    assert _parse_version("4.0.0") > _parse_version("4.0.0b1")
+    assert _parse_version("4.0.0") > _parse_version("4.0.0rc2")
+    assert _parse_version("4.0.0rc2") > _parse_version("4.0.0b1")
+    assert _parse_version("4.0.0b2") > _parse_version("4.0.0b1")
+    assert _parse_version("1.2") == _parse_version("1.2.0")
+    assert _parse_version("4.0.0.post1") > _parse_version("4.0.0")
+    assert _parse_version("4.0.1") > _parse_version("4.0.0.post1")
+    assert _parse_version("4.0.0a1") > _parse_version("4.0.0.dev1")
+    assert _parse_version("4.0.0b1") > _parse_version("4.0.0.dev1")
+    assert _parse_version("4.0.0") > _parse_version("4.0.0.dev1")
+    with pytest.raises(ValueError, match="unknown version tag"):
+        _parse_version("4.0.0foo1")
+
+
 def test_remove_dupe():
     e = Episode.remove_duplicated_bangumi(
         [
@@ -96,3 +139,111 @@ def test_get_player():
         1: {"path": "/test-save-path/ss/1/q/bigger.mkv"},
         2: {"path": "/test-save-path/ss/2/2.mp4"},
     }
+
+
+def test_cached_get_json(tmp_path):
+    session = mock.Mock()
+    session.get.return_value = mock.Mock(status_code=200, headers={})
+    session.get.return_value.json.return_value = {"version": "1.0.0"}
+    with mock.patch("bgmi.utils._SESSION", session), mock.patch(
+        "bgmi.utils._HTTP_CACHE_PATH", tmp_path.joinpath("http_cache.json")
+    ):
+        assert _cached_get_json("https://example.com/a.json", 60) == {"version": "1.0.0"}
+        assert _cached_get_json("https://example.com/a.json", 60) == {"version": "1.0.0"}
+        session.get.assert_called_once()
+
+        _cached_get_json("https://example.com/a.json", 0)
+        assert session.get.call_count == 2
+
+
+def test_cached_get_json_etag(tmp_path):
+    session = mock.Mock()
+    session.get.return_value = mock.Mock(status_code=200, headers={"etag": '"v1"'})
+    session.get.return_value.json.return_value = {"version": "1.0.0"}
+    with mock.patch("bgmi.utils._SESSION", session), mock.patch(
+        "bgmi.utils._HTTP_CACHE_PATH", tmp_path.joinpath("http_cache.json")
+    ):
+        _cached_get_json("https://example.com/a.json", 0)
+
+        session.get.return_value = mock.Mock(status_code=304, headers={})
+        assert _cached_get_json("https://example.com/a.json", 0) == {"version": "1.0.0"}
+        session.get.assert_called_with("https://example.com/a.json", timeout=60, headers={"If-None-Match": '"v1"'})
+        session.get.return_value.json.assert_not_called()
+
+
+def test_download_cover(tmp_path):
+    def get(url, **kwargs):
+        r = mock.MagicMock(ok=True)
+        r.iter_content.return_value = [url.encode(), b"-content"]
+        return r
+
+    session = mock.Mock()
+    session.get.side_effect = get
+    urls = [f"https://example.com/cover/{i}.jpg" for i in range(5)]
+    with mock.patch("bgmi.utils._SESSION", session), mock.patch.object(cfg, "save_path", tmp_path):
+        download_cover(urls + urls[:2] + ["not-a-url"])
+
+        assert session.get.call_count == len(urls)
+        for url in urls:
+            _, file_path = convert_cover_url_to_path(url)
+            with open(file_path, "rb") as f:
+                assert f.read() == url.encode() + b"-content"
+
+        assert not list(tmp_path.rglob("*.part"))
+
+
+def _frontend_tarball(files):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize(
+    ("body", "status", "swap_fails", "installed"),
+    [
+        (_frontend_tarball({"package/dist/index.html": b"new"}), 200, False, True),
+        (_frontend_tarball({"package/dist/index.html": b"new"}), 200, True, False),
+        (_frontend_tarball({"package/dist/index.html": b"new"})[:50], 200, False, False),
+        (_frontend_tarball({"package/README.md": b"no dist"}), 200, False, False),
+        (b"not found", 404, False, False),
+    ],
+)
+def test_get_web_admin(tmp_path, body, status, swap_fails, installed):
+    _replace = os.replace
+
+    def replace(src, dst):
+        if swap_fails and str(src).endswith("dist"):
+            raise PermissionError(src)
+        return _replace(src, dst)
+
+    front_static_path = tmp_path.joinpath("front_static")
+    front_static_path.mkdir()
+    front_static_path.joinpath("index.html").write_bytes(b"old")
+
+    package_json = {
+        "version": "1.0.0",
+        "dist": {"tarball": "https://example.com/bgmi-frontend-1.0.0.tgz"},
+    }
+    resp = mock.MagicMock(status_code=status, raw=io.BytesIO(body))
+    resp.__enter__.return_value = resp
+    if status != 200:
+        resp.raise_for_status.side_effect = requests.HTTPError(status)
+
+    with mock.patch("bgmi.utils._cached_get_json", return_value=package_json), mock.patch(
+        "bgmi.utils._SESSION.get", return_value=resp
+    ), mock.patch.object(cfg, "front_static_path", front_static_path), mock.patch(
+        "os.replace", side_effect=replace
+    ):
+        get_web_admin(method="install")
+
+    if installed:
+        assert sorted(p.name for p in front_static_path.iterdir()) == ["index.html", "package.json"]
+        assert front_static_path.joinpath("index.html").read_bytes() == b"new"
+    else:
+        assert sorted(p.name for p in front_static_path.iterdir()) == ["index.html"]
+        assert front_static_path.joinpath("index.html").read_bytes() == b"old"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["front_static"]